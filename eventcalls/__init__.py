@@ -22,8 +22,12 @@
 # SOFTWARE.
 #
 
+import os as _os
+import sys as _sys
+import queue as _queue
 import logging as _logging
 import threading as _threading
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
 from traceback import print_exc as _print_exc
 
 """eventcalls -- a threaded way for achieving event callbacks."""
@@ -31,13 +35,54 @@ from traceback import print_exc as _print_exc
 VERSION_STR = "1.0.4"
 DETAILED_ERROR = False
 
+# False on a free-threaded (e.g. 3.13t) interpreter running without the GIL,
+# in which case handlers in different Routine threads run in parallel.
+GIL_ENABLED = getattr(_sys, '_is_gil_enabled', lambda: True)()
+
 _logging.basicConfig(level=_logging.INFO,
                      format="[%(asctime)s %(name)s] %(levelname)s: %(message)s")
 LOGGER = _logging.getLogger(__name__)
 LOGGER.setLevel(_logging.INFO)
 
+_pool      = None
+_pool_size = _os.cpu_count() or 1
+_pool_lock = _threading.Lock()
+
+def set_pool_size(n):
+    """sets the number of the worker threads shared among Reactors
+    for calling the handlers (defaults to the number of CPUs).
+
+    the previous pool, if any, shuts down after finishing its pending work;
+    work submitted afterwards goes to a new pool of the specified size.
+    """
+    global _pool, _pool_size
+    if n < 1:
+        raise ValueError(f"pool size must be positive: {n}")
+    with _pool_lock:
+        _pool_size = n
+        old, _pool = _pool, None
+    if old is not None:
+        old.shutdown(wait=False)
+
+def _submit(fn, *args):
+    """submits `fn` to the shared worker pool.
+    this is done under the lock, so that the pool cannot be shut down
+    by `set_pool_size()` in the meantime."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _ThreadPoolExecutor(max_workers=_pool_size,
+                                        thread_name_prefix="eventcalls-worker")
+        return _pool.submit(fn, *args)
+
 class EventSource:
     """the interface for an event generator."""
+    __slots__ = ()
+
+    # True if an event is only valid until the next one is generated
+    # (e.g. it is a view into a reused buffer). such events must be handled
+    # in the reading thread, i.e. without a queue or a reactor.
+    transient_events = False
 
     def setup(self):
         """the setup routine for this event source.
@@ -72,10 +117,24 @@ class EventSource:
 
 class Writable:
     """the interface for a writable EventSource."""
+    __slots__ = ()
     def write(self, data):
         """writes `data` to its endpoint."""
         pass
 
+class Selectable:
+    """the interface for an EventSource that can be driven by a Reactor,
+    instead of being iterated over in a dedicated thread."""
+    __slots__ = ()
+    def fileno(self):
+        """returns the file descriptor to be watched for read-readiness."""
+        pass
+
+    def read_available(self):
+        """reads the events that are available without blocking,
+        and returns them as a list."""
+        pass
+
 class EventHandler:
     """the interface for an event handler.
     EventHandler subclasses can be made to implement a protocol.
@@ -92,6 +151,17 @@ class EventHandler:
         """called in the Routine thread for handling the generated event."""
         pass
 
+    def handle_batch(self, evts):
+        """called instead of `handle()` with a list of events, when several
+        events are available at once.
+
+        the default implementation calls `handle()` for each event in turn.
+        handlers that can process events in bulk may override it to save
+        a Python call per event.
+        """
+        for evt in evts:
+            self.handle(evt)
+
     def done(self, evt=None):
         """called in the Routine thread after finalizing the EventSource
         to perform any required cleanup jobs for this handler.
@@ -102,7 +172,13 @@ class EventHandler:
 
 
 class EventHandlerProxy(EventHandler):
-    """the EventHandler object to be used with fixed callback functions."""
+    """the EventHandler object to be used with fixed callback functions.
+
+    the callbacks are set upon initialization and never changed afterwards,
+    so a proxy may be shared among Routines. note that the callback functions
+    themselves then get called from multiple threads at once (truly in parallel
+    unless GIL_ENABLED), and must guard any state they share.
+    """
     def __init__(self, fhandle=None, finit=None, fdone=None):
         if finit is not None:
             self.initialized = finit
@@ -111,24 +187,96 @@ class EventHandlerProxy(EventHandler):
         if fdone is not None:
             self.done = fdone
 
+def _log_read_error(source, e):
+    if DETAILED_ERROR == True:
+        LOGGER.error(f"***error in reading from {source}:")
+        _print_exc()
+    else:
+        LOGGER.error(f"***failed to read from source for {source}: {e}")
+
+_STOP = object() # tells the consumer threads of a Routine to stop
+
+def _apply_scheduling(cpu=None, realtime=False, priority=50):
+    """pins the calling thread to `cpu`, and/or puts it under the SCHED_FIFO policy.
+    failures (e.g. on non-Linux platforms, or without permission) are only logged."""
+    if cpu is not None:
+        try:
+            _os.sched_setaffinity(0, {cpu})
+        except (AttributeError, OSError) as e:
+            LOGGER.warning(f"***could not pin the thread to CPU {cpu}: {e}")
+    if realtime == True:
+        try:
+            _os.sched_setscheduler(0, _os.SCHED_FIFO, _os.sched_param(priority))
+        except (AttributeError, OSError) as e:
+            LOGGER.warning(f"***could not apply the real-time scheduling policy "
+                           f"(requires the CAP_SYS_NICE capability): {e}")
+
 class Routine:
     """the class implemented with the thread loop for event generation."""
-    def __init__(self, src, handler, start=True):
+    batchsize = 64 # max. number of queued events to pass to `handle_batch()` at once
+    realtime_priority = 50 # SCHED_FIFO priority for `realtime` routines
+
+    def __init__(self, src, handler, start=True, reactor=None,
+                 queue_size=None, workers=1, drop_oldest=False, flush_fraction=0.5,
+                 cpu=None, realtime=False):
         """initializes the routine.
 
         parameters
         ----------
-        src     -- a EventSource object.
-        handler -- a EventHandler object.
-        start   -- whether to start the thread immediately.
+        src        -- a EventSource object.
+        handler    -- a EventHandler object.
+        start      -- whether to start the thread immediately.
+        reactor    -- a `eventcalls.reactor.Reactor` object to drive `src` with,
+                      instead of a dedicated thread (`True` for the shared one).
+                      it only takes effect when `src` is `Selectable`.
+        queue_size -- if not None, the events are put into a queue of this size,
+                      and handled in separate consumer threads, so that a slow handler
+                      does not hold up reading. reading blocks while the queue is full.
+                      (not used when driven by a reactor, which already hands events
+                      over to worker threads.)
+        workers    -- the number of the consumer threads (when `queue_size` is set; at least 1).
+                      with more than one worker, events may be handled out of order.
+        drop_oldest    -- if True, reading never blocks on a full queue; the oldest
+                          queued event is dropped instead (see `dropped_count`).
+        flush_fraction -- once the queue gets filled beyond this fraction, the consumers
+                          take out up to this fraction of the queue per `handle_batch()` call
+                          (instead of `batchsize` events), to catch up with the reader.
+        cpu        -- (Linux only) the CPU to pin the reading thread to.
+        realtime   -- (Linux only) if True, the reading thread runs under the SCHED_FIFO
+                      policy, so that it is not preempted by ordinary threads.
+                      this requires the CAP_SYS_NICE capability, e.g. by
+                      `sudo setcap cap_sys_nice+ep <path to the python executable>`.
+                      `cpu` and `realtime` are ignored when driven by a reactor.
         """
         self._source   = src
         self._handler  = handler
-        self.__thread  = _threading.Thread(target=self.run)
+        self.__queue   = _queue.Queue(queue_size) if queue_size is not None else None
+        self.__workers = workers
+        self.__failure = None
+        self.__drop_oldest    = drop_oldest
+        self.__flush_fraction = flush_fraction
+        self.__dropped        = 0
+        self.__cpu            = cpu
+        self.__realtime       = realtime
+        if reactor is True:
+            reactor = _reactor.shared()
+        transient = getattr(src, 'transient_events', False)
+        if transient and (queue_size is not None):
+            raise ValueError(f"events from {src} are transient, and cannot be queued")
+        if (queue_size is not None) and (workers < 1):
+            raise ValueError(f"number of workers must be positive: {workers}")
+        if (reactor is not None) and isinstance(src, Selectable):
+            if transient:
+                raise ValueError(f"events from {src} are transient, and cannot be handled by a reactor")
+            self.__reactor = reactor
+            self.__thread  = None
+        else:
+            self.__reactor = None
+            self.__thread  = _threading.Thread(target=self.run)
+        self.__registration = None
         self.__running = False
         if start == True:
-            self.__thread.start()
-            self.__running = True
+            self.start()
 
     @property
     def source(self):
@@ -138,8 +286,25 @@ class Routine:
     def handler(self):
         return self._handler
 
+    @property
+    def queue_fill_fraction(self):
+        """the fraction of the event queue currently occupied
+        (always 0 when running without a queue)."""
+        if self.__queue is None or self.__queue.maxsize <= 0:
+            return 0.0
+        return self.__queue.qsize() / self.__queue.maxsize
+
+    @property
+    def dropped_count(self):
+        """the number of events dropped from a full queue (with `drop_oldest`)."""
+        return self.__dropped
+
     def start(self):
-        """starts the thread, if not yet."""
+        """starts the thread (or registers to the reactor), if not yet."""
+        if self.__reactor is not None:
+            if self.__registration is None:
+                self.__registration = self.__reactor.register(self._source, self._handler)
+            return
         if not self.__thread.is_alive():
             self.__thread.start()
             self.__running = True
@@ -149,19 +314,37 @@ class Routine:
         status = self.source.setup()
         self.handler.initialized(status)
 
-        status = None
+        status    = None
+        consumers = []
+        if self.__queue is not None:
+            for _ in range(self.__workers):
+                consumer = _threading.Thread(target=self.__consume)
+                consumer.start()
+                consumers.append(consumer)
+        # applied after spawning the consumers, so that they do not inherit it
+        if (self.__cpu is not None) or (self.__realtime == True):
+            _apply_scheduling(self.__cpu, self.__realtime, self.realtime_priority)
         try:
-            for evt in self.source:
-                self.handler.handle(evt)
-        except OSError as e:
-            if DETAILED_ERROR == True:
-                LOGGER.error("***error in reading from {self.source}:")
-                _print_exc()
+            # the callables are bound to locals once, outside the event loop
+            if self.__queue is not None:
+                put = self.__put_dropping if self.__drop_oldest else self.__queue.put
+                for evt in self.source:
+                    put(evt)
             else:
-                LOGGER.error(f"***failed to read from source for {self.source}: {e}")
+                handle = self.handler.handle
+                for evt in self.source:
+                    handle(evt)
+        except OSError as e:
+            _log_read_error(self.source, e)
             status = e
             self.__running = False
         finally:
+            for consumer in consumers:
+                self.__queue.put(_STOP)
+            for consumer in consumers:
+                consumer.join()
+            if self.__failure is not None:
+                status = self.__failure
             try:
                 self.source.finalize()
                 self.__running = False
@@ -171,7 +354,60 @@ class Routine:
             finally:
                 self.handler.done(status)
 
+    def __put_dropping(self, evt):
+        """puts `evt` into the queue, dropping the oldest event(s) if it is full."""
+        q = self.__queue
+        while True:
+            try:
+                q.put_nowait(evt)
+                return
+            except _queue.Full:
+                try:
+                    q.get_nowait()
+                    self.__dropped += 1
+                except _queue.Empty:
+                    pass
+
+    def __consume(self):
+        """the consumer loop, when running with a queue.
+        the events queued at the time are handled together using `handle_batch()`."""
+        q = self.__queue
+        get, get_nowait = q.get, q.get_nowait
+        if q.maxsize > 0:
+            threshold = q.maxsize * self.__flush_fraction
+            flushsize = max(self.batchsize, int(threshold))
+        else:
+            threshold = None
+            flushsize = self.batchsize
+        while True:
+            batch = []
+            evt   = get()
+            if (threshold is not None) and (q.qsize() > threshold):
+                limit = flushsize
+            else:
+                limit = self.batchsize
+            while evt is not _STOP:
+                batch.append(evt)
+                if len(batch) >= limit:
+                    break
+                try:
+                    evt = get_nowait()
+                except _queue.Empty:
+                    break
+            # keep draining after a failure, so that the reader does not block
+            if batch and (self.__failure is None):
+                try:
+                    self.handler.handle_batch(batch)
+                except Exception as e:
+                    LOGGER.error(f"***failed to handle an event from {self.source}: {e}")
+                    self.__failure = e
+                    self.source.cancel()
+            if evt is _STOP:
+                return
+
     def is_running(self):
+        if self.__registration is not None:
+            return self.__registration.is_active()
         return self.__running
 
     def write(self, data):
@@ -184,7 +420,13 @@ class Routine:
 
     def stop(self):
         """cancels its underlying EventSource routine, and joins its thread."""
+        if self.__reactor is not None:
+            if self.__registration is not None:
+                self.__reactor.unregister(self.__registration)
+                self.__registration.wait()
+            return
         self.source.cancel()
         self.__thread.join()
 
 from . import io
+from . import reactor as _reactor
@@ -25,10 +25,15 @@
 import socket as _socket
 import threading as _threading
 import selectors as _selectors
+from collections import deque as _deque
 
 from . import EventSource as _EventSource, \
               Writable as _Writable, \
+              Selectable as _Selectable, \
               LOGGER as _LOGGER
+from .reactor import _Waker
+
+_MSG_DONTWAIT = getattr(_socket, 'MSG_DONTWAIT', 0) # unavailable on Windows
 
 class StreamIsClosed(OSError):
     def __init__(self, msg):
@@ -40,24 +45,34 @@ class InputStream(_EventSource):
 
     subclasses are supposed to override the following methods:
     - `read_single()`: reads a message (can be in any form) and returns it.
+      returns `CANCELED` instead, once it finds the stream canceled.
     - `close()`: closes the endpoint.
     """
+    __slots__ = ('_canceled', '__weakref__')
+
     DEFAULT_TIMEOUT_SEC = None
+    CANCELED = object() # returned from `read_single()` to end the iteration
 
     def __init__(self):
         super().__init__()
-        self.__canceled = _threading.Event()
+        self._canceled = False
 
     def __iter__(self):
+        read     = self.read_single
+        sentinel = self.CANCELED
         try:
             while True:
-                yield self.read_single()
-        except:
-            if not self.canceled:
+                evt = read()
+                if evt is sentinel:
+                    return
+                yield evt
+        except Exception:
+            # the endpoint may get closed under a blocking read
+            if not self._canceled:
                 raise
 
     def cancel(self):
-        self.__canceled.set()
+        self._canceled = True
         # close the endpoint anyway
         try:
             self.close()
@@ -68,9 +83,55 @@ class InputStream(_EventSource):
 
     @property
     def canceled(self):
-        return self.__canceled.is_set()
+        return self._canceled
+
+class Datagram:
+    """a reusable datagram event, generated by a DatagramIO with a non-zero `poolsize`.
+
+    `data` is a memoryview into a receive buffer owned by the DatagramIO, and
+    `address` is the address of the sender. it can still be unpacked
+    as a (data, address) pair.
+
+    the handler is supposed to call `release()` (or to use it as a context manager)
+    once it is done with the data, so that the buffer can be reused for
+    receiving later datagrams. copy the data (e.g. `bytes(evt.data)`) if it
+    needs to be retained after release.
+    """
+    __slots__ = ('data', 'address', '_buffer', '_view', '_pool', '_poolsize')
+
+    def __init__(self, buffersize, pool, poolsize):
+        self.data      = None
+        self.address   = None
+        self._buffer   = bytearray(buffersize)
+        self._view     = memoryview(self._buffer)
+        self._pool     = pool
+        self._poolsize = poolsize
+
+    def __iter__(self):
+        return iter((self.data, self.address))
+
+    def __getitem__(self, index):
+        return (self.data, self.address)[index]
+
+    def __len__(self):
+        return 2
+
+    def __enter__(self):
+        return self
 
-class DatagramIO(InputStream, _Writable):
+    def __exit__(self, *args):
+        self.release()
+
+    def release(self):
+        """returns this object to the pool of its DatagramIO."""
+        if self.data is None:
+            return
+        self.data    = None
+        self.address = None
+        if len(self._pool) < self._poolsize:
+            self._pool.append(self)
+
+class DatagramIO(InputStream, _Writable, _Selectable):
     """an EventSource that keeps reading from the paired UDP endpoint.
     the endpoint can be either listening socket, or the one used for
     sending packets.
@@ -80,53 +141,180 @@ class DatagramIO(InputStream, _Writable):
 
     the size of the buffer can be changed using the `buffersize` parameter
     on initialization.
+
+    with a non-zero `poolsize`, the events are `Datagram` objects instead,
+    whose receive buffers are recycled once they are `release()`d.
+    `poolsize` limits the number of idle buffers kept for reuse.
+
+    with `copy=False` (and no pool), datagrams are received into a single buffer
+    and the events are in the form of (memoryview, address). the view is valid
+    only until the next datagram is read, so the handler must copy the data
+    if it needs to retain it. `transient_events` is True in this mode, and
+    Routine refuses to run it with a queue or a reactor. datagrams are read
+    one at a time in this mode.
+
+    it can also be driven by a `eventcalls.reactor.Reactor`, instead of
+    being iterated over in its own thread.
+
+    the blocking mode of the endpoint is left as it is: reads wait for readiness
+    in `select`, and then drain the socket using MSG_DONTWAIT, where available
+    (or check the readiness before each read, on sockets with a timeout).
     """
-    timeout = .5 # 0.5-sec timeout for `select` call
+    __slots__ = ('__port', '__endpoint', '__send', '__sendto', '__waker', '__selector',
+                 '__burst', 'buffersize', '__poolsize', '__pool', '__recvbuf', '__recvview',
+                 '__single', '__recv', 'timeout', 'batchsize')
+
+    # the defaults for the per-instance settings:
+    DEFAULT_SELECT_TIMEOUT = None # `timeout` for `select` call (cancel() wakes it up anyway)
+    DEFAULT_BATCHSIZE      = 64   # `batchsize`: max. number of datagrams to read upon a single readiness
 
     @classmethod
-    def bind(cls, port, buffersize=1024):
+    def bind(cls, port, buffersize=1024, poolsize=0, copy=True):
         """creates a Reader using a listening port
         bound to the specified host and port."""
         endpoint = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM, _socket.IPPROTO_UDP)
         endpoint.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
         endpoint.settimeout(cls.DEFAULT_TIMEOUT_SEC)
         endpoint.bind(('localhost', port))
-        return cls(endpoint, buffersize=buffersize, port=port)
+        return cls(endpoint, buffersize=buffersize, port=port, poolsize=poolsize, copy=copy)
 
-    def __init__(self, endpoint, buffersize=1024, port="(unknown)"):
+    def __init__(self, endpoint, buffersize=1024, port="(unknown)", poolsize=0, copy=True):
         """endpoint: datagram port to read from"""
         super().__init__()
         self.__port     = port
         self.__endpoint = endpoint
+        self.__send     = endpoint.send # resolved once for the write path
+        self.__sendto   = endpoint.sendto
+        self.__waker    = _Waker()
         self.__selector = _selectors.DefaultSelector()
         self.__selector.register(self.__endpoint, _selectors.EVENT_READ, 'ready')
+        self.__selector.register(self.__waker, _selectors.EVENT_READ, 'cancel')
+        self.__burst    = _deque() # datagrams read but not yet returned
         self.buffersize = buffersize
+        self.timeout    = self.DEFAULT_SELECT_TIMEOUT
+        self.batchsize  = self.DEFAULT_BATCHSIZE
+        self.__poolsize = poolsize
+        self.__pool     = None
+        self.__recvbuf  = None
+        self.__recvview = None
+        self.__single   = False # whether to read one datagram per readiness
+        if poolsize > 0:
+            self.__pool = _deque()
+            self.__pool.extend(Datagram(buffersize, self.__pool, poolsize) for _ in range(poolsize))
+            self.__recv = DatagramIO.__recv_pooled
+        elif copy == False:
+            self.__recvbuf  = bytearray(buffersize)
+            self.__recvview = memoryview(self.__recvbuf)
+            self.__recv     = DatagramIO.__recv_view
+            self.__single   = True
+        else:
+            self.__recv = DatagramIO.__recv_bytes
 
     def __repr__(self):
         return f"DatagramIO(port={self.__port})"
 
+    # override(EventSource)
+    @property
+    def transient_events(self):
+        return self.__single
+
     # override(Writable)
     def write(self, data):
         if isinstance(data, str):
             data = data.encode('utf-8')
-        self.__endpoint.write(data)
+        self.__send(data)
+
+    def write_many(self, data, addresses):
+        """sends the same `data` to each of `addresses` (e.g. for broadcasting
+        to multiple peers). works with unconnected endpoints, too."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        sendto = self.__sendto
+        for addr in addresses:
+            sendto(data, addr)
 
     # override(InputStream)
     def read_single(self):
-        """calls recvfrom() using the attached endpoint."""
+        """calls recvfrom() using the attached endpoint.
+
+        all the datagrams available upon readiness are read at once
+        (see `read_available()`), and returned one by one."""
+        if self.__burst:
+            return self.__burst.popleft()
         try:
             while True:
                 events = self.__selector.select(self.timeout)
-                if self.canceled:
+                if self._canceled:
                     self.close()
-                    raise StreamIsClosed(f"UDP port {self.__port}")
+                    return self.CANCELED
                 for key, mask in events:
                     if key.data == 'ready':
-                        return self.__endpoint.recvfrom(self.buffersize)
+                        self.__burst.extend(self.read_available())
+                        if self.__burst: # may be empty upon a spurious wakeup
+                            return self.__burst.popleft()
         except OSError:
             self.__endpoint = None
             raise
 
+    # override(InputStream)
+    def cancel(self):
+        super().cancel()
+        # wake up the reader blocking in `select` (no-op once finalized)
+        self.__waker.wake()
+
+    # override(Selectable)
+    def fileno(self):
+        return self.__endpoint.fileno()
+
+    # override(Selectable)
+    def read_available(self):
+        """calls recvfrom() until the socket is drained (up to `batchsize` times).
+        supposed to be called upon read-readiness; may return an empty list."""
+        # `__recv` holds a plain function, rather than a bound method
+        # that would make a reference cycle with this object
+        recv   = self.__recv
+        limit  = 1 if self.__single == True else self.batchsize
+        if not _MSG_DONTWAIT or self.__endpoint.gettimeout() is not None:
+            # MSG_DONTWAIT is unavailable, or ignored on sockets with a timeout
+            # (which wait for readiness before the call): only the first read is
+            # known not to block, so check the readiness before each of the others
+            events = [recv(self, 0)]
+            while len(events) < limit and self.__readable():
+                events.append(recv(self, 0))
+            return events
+        events = []
+        try:
+            while len(events) < limit:
+                events.append(recv(self, _MSG_DONTWAIT))
+        except BlockingIOError:
+            pass
+        return events
+
+    def __readable(self):
+        for key, mask in self.__selector.select(0):
+            if key.data == 'ready':
+                return True
+        return False
+
+    def __recv_bytes(self, flags):
+        return self.__endpoint.recvfrom(self.buffersize, flags)
+
+    def __recv_view(self, flags):
+        nbytes, addr = self.__endpoint.recvfrom_into(self.__recvbuf, 0, flags)
+        return self.__recvview[:nbytes], addr
+
+    def __recv_pooled(self, flags):
+        pool = self.__pool
+        dgram = pool.popleft() if pool else Datagram(self.buffersize, pool, self.__poolsize)
+        try:
+            nbytes, addr = self.__endpoint.recvfrom_into(dgram._buffer, 0, flags)
+        except OSError:
+            pool.append(dgram)
+            raise
+        dgram.data    = dgram._view[:nbytes]
+        dgram.address = addr
+        return dgram
+
     # override(EventSource)
     def close(self):
         if self.__endpoint:
@@ -136,6 +324,11 @@ class DatagramIO(InputStream, _Writable):
             except OSError:
                 pass
 
+    # override(EventSource)
+    def finalize(self):
+        self.__selector.close()
+        self.__waker.close()
+
 try:
     import serial as _serial # pyserial
 
@@ -144,6 +337,8 @@ try:
         this class is available only when PySerial (or a `serial` module) is
         properly installed.
         """
+        __slots__ = ('__endpoint', '__transact', '__line_oriented', '__rxbuf')
+
         @classmethod
         def open(cls, addr, line_oriented=True, timeout=0.1, **kwargs):
             endpoint = _serial.Serial(addr, timeout=timeout, **kwargs)
@@ -154,36 +349,51 @@ try:
             self.__endpoint      = endpoint
             self.__transact      = _threading.Lock()
             self.__line_oriented = line_oriented
+            self.__rxbuf         = bytearray() # received but not yet returned
 
         # override(Writable)
         def write(self, data):
             if isinstance(data, str):
                 data = data.encode('utf-8')
-            if (self.__line_oriented == True) and (data[-1] != b'\n'):
+            if (self.__line_oriented == True) and (not data.endswith(b'\n')):
                 data = data + b'\r\n'
             with self.__transact:
                 self.__endpoint.write(data)
 
         # override(InputStream)
         def read_single(self):
-            msg = None
-            while msg is None:
-                msg = self.__endpoint.read(1)
-                if self.canceled:
-                    self.close()
-                    raise StreamIsClosed(f"Serial port {self.__endpoint.name}")
+            """reads a line (or a byte, if not line-oriented).
+            the read is retried upon every timeout of the endpoint,
+            until the data is complete or the stream gets canceled."""
+            buf = self.__rxbuf
             if self.__line_oriented == False:
+                while not buf:
+                    if (not self.__fill()) and self._canceled:
+                        self.close()
+                        return self.CANCELED
+                msg = bytes(buf[:1])
+                del buf[:1]
                 return msg
-            while not msg.endswith(b'\n'):
-                c   = self.__endpoint.read(1)
-                if self.canceled:
+
+            idx = buf.find(b'\n')
+            while idx < 0:
+                scanned = len(buf) # no need to scan this part again
+                if (not self.__fill()) and self._canceled:
                     self.close()
-                    raise StreamIsClosed(f"Serial port {self.__endpoint.name}")
-                if c is None:
-                    return msg
-                msg = msg + c
+                    return self.CANCELED
+                idx = buf.find(b'\n', scanned)
+            msg = bytes(buf[:idx+1])
+            del buf[:idx+1]
             return msg
 
+        def __fill(self):
+            """reads whatever is available (or waits for a byte) into the receive buffer.
+            returns False upon timeout."""
+            endpoint = self.__endpoint
+            chunk    = endpoint.read(endpoint.in_waiting or 1)
+            self.__rxbuf += chunk
+            return len(chunk) > 0
+
         # override(EventSource)
         def close(self):
             try:
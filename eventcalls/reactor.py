@@ -0,0 +1,319 @@
+#
+# MIT License
+#
+# Copyright (c) 2019 Keisuke Sehara
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+import os as _os
+import socket as _socket
+import threading as _threading
+import selectors as _selectors
+from collections import deque as _deque
+from functools import partial as _partial
+
+from . import Selectable as _Selectable, \
+              LOGGER as _LOGGER, \
+              _log_read_error, \
+              _submit as _submit_to_pool
+
+"""a single-thread reactor for driving multiple event sources."""
+
+class _Waker:
+    """a file descriptor to be selected on, which becomes readable upon `wake()`.
+    it uses an eventfd where available, and a socket pair otherwise.
+    `wake()` and `clear()` do nothing once it is closed."""
+    def __init__(self):
+        self.__lock = _threading.Lock() # so that the fd is not closed under `wake()`
+        if hasattr(_os, 'eventfd'):
+            self.__fd   = _os.eventfd(0, _os.EFD_NONBLOCK | _os.EFD_CLOEXEC)
+            self.__pair = None
+        else:
+            self.__pair = _socket.socketpair()
+            self.__fd   = self.__pair[0].fileno()
+            for sock in self.__pair:
+                sock.setblocking(False)
+
+    def fileno(self):
+        return self.__fd
+
+    def wake(self):
+        with self.__lock:
+            if self.__fd is None:
+                return
+            try:
+                if self.__pair is None:
+                    _os.eventfd_write(self.__fd, 1)
+                else:
+                    self.__pair[1].send(b'\0')
+            except BlockingIOError: # there is already a pending wakeup
+                pass
+
+    def clear(self):
+        with self.__lock:
+            if self.__fd is None:
+                return
+            try:
+                if self.__pair is None:
+                    _os.eventfd_read(self.__fd)
+                else:
+                    while self.__pair[0].recv(1024):
+                        pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        with self.__lock:
+            if self.__fd is None:
+                return
+            if self.__pair is None:
+                _os.close(self.__fd)
+            else:
+                for sock in self.__pair:
+                    sock.close()
+            self.__fd   = None
+            self.__pair = None
+
+class Registration:
+    """a handle for an EventSource-EventHandler pair running on a Reactor.
+
+    the callbacks of the handler are serialized: they are called one at a time
+    and in order, though not necessarily from the same worker thread.
+    """
+    def __init__(self, reactor, source, handler):
+        self._reactor    = reactor
+        self._source     = source
+        self._handler    = handler
+        self._fd         = None
+        self.__pending   = _deque()
+        self.__lock      = _threading.Lock()
+        self.__scheduled = False
+        self.__closing   = False
+        self.__finished  = _threading.Event()
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def handler(self):
+        return self._handler
+
+    def is_active(self):
+        return not self.__finished.is_set()
+
+    def wait(self, timeout=None):
+        """waits until the `done` callback of the handler returns."""
+        return self.__finished.wait(timeout)
+
+    def _post(self, task):
+        with self.__lock:
+            self.__pending.append(task)
+            if self.__scheduled == True:
+                return
+            self.__scheduled = True
+        try:
+            self._reactor._submit(self.__drain)
+        except Exception: # so that a later post may try submitting again
+            with self.__lock:
+                self.__scheduled = False
+            raise
+
+    def _post_initialized(self, status):
+        self._post(_partial(self.__initialize, status))
+
+    def _post_events(self, events):
+        self._post(_partial(self.__handle, events))
+
+    def _close(self, status=None):
+        self.__closing = True
+        self._post(_partial(self.__finish, status))
+
+    def __drain(self):
+        try:
+            while True:
+                # take out all the pending tasks at once, so that
+                # the reactor can keep on posting in the meantime
+                with self.__lock:
+                    if not self.__pending:
+                        self.__scheduled = False
+                        return
+                    tasks = list(self.__pending)
+                    self.__pending.clear()
+                for task in tasks:
+                    try:
+                        task()
+                    except Exception as e: # keep on running the rest of the tasks
+                        _LOGGER.error(f"***task for {self._source} failed: {e}")
+        except BaseException: # so that a later post may schedule draining again
+            with self.__lock:
+                self.__scheduled = False
+            raise
+
+    def __initialize(self, status):
+        try:
+            self._handler.initialized(status)
+        except Exception as e:
+            _LOGGER.error(f"***failed to initialize the handler for {self._source}: {e}")
+            self.__closing = True
+            self._reactor.unregister(self, status=e)
+
+    def __handle(self, events):
+        if self.__closing == True:
+            return
+        try:
+            self._handler.handle_batch(events)
+        except Exception as e:
+            _LOGGER.error(f"***failed to handle events from {self._source}: {e}")
+            self.__closing = True
+            self._reactor.unregister(self, status=e)
+
+    def __finish(self, status):
+        try:
+            self._source.finalize()
+        except Exception as e:
+            status = e
+        try:
+            self._handler.done(status)
+        finally:
+            self.__finished.set()
+
+class Reactor:
+    """drives multiple `Selectable` event sources from a single thread.
+
+    instead of having a dedicated thread blocking on each source, the reactor
+    waits on all of their file descriptors at once, reads whatever is available,
+    and passes the events on to a pool of worker threads for handling.
+    handlers of different sources run in parallel only when the interpreter
+    runs without the GIL (see `eventcalls.GIL_ENABLED`).
+    """
+    def __init__(self, executor=None):
+        """executor -- the `concurrent.futures.Executor` for calling the handlers.
+        defaults to the worker pool shared within the process
+        (see `eventcalls.set_pool_size()`)."""
+        self.__executor  = executor
+        self.__selector  = _selectors.DefaultSelector()
+        self.__commands  = _deque()
+        self.__lock      = _threading.Lock()
+        self.__thread    = None
+        self.__waker     = _Waker()
+        self.__selector.register(self.__waker, _selectors.EVENT_READ, None)
+
+    def _submit(self, fn):
+        if self.__executor is not None:
+            return self.__executor.submit(fn)
+        return _submit_to_pool(fn)
+
+    def register(self, source, handler):
+        """sets up `source`, and starts watching it for events to be passed to `handler`.
+        returns a `Registration` object."""
+        if not isinstance(source, _Selectable):
+            raise TypeError(f"source {source} is not selectable")
+        if getattr(source, 'transient_events', False):
+            raise ValueError(f"events from {source} are transient, and cannot be handled by a reactor")
+        reg    = Registration(self, source, handler)
+        status = source.setup()
+        self.__command(self.__add, reg, status)
+        return reg
+
+    def unregister(self, registration, status=None):
+        """stops watching the source of `registration`, and cancels it.
+        the handler's `done` method will be called (with `status`) afterwards."""
+        self.__command(self.__remove, registration, status)
+
+    def __command(self, func, *args):
+        with self.__lock:
+            self.__commands.append((func, args))
+            if self.__thread is None:
+                self.__thread = _threading.Thread(target=self.__run,
+                                                  name="eventcalls-reactor",
+                                                  daemon=True)
+                self.__thread.start()
+        self.__waker.wake()
+
+    def __add(self, reg, status):
+        # posted from the reactor thread, so that `initialized` is called before
+        # any events are handled, and an `unregister` from it comes after this
+        reg._post_initialized(status)
+        try:
+            reg._fd = reg.source.fileno()
+            self.__selector.register(reg._fd, _selectors.EVENT_READ, reg)
+        except Exception as e: # e.g. a closed source, or a file descriptor registered twice
+            _log_read_error(reg.source, e)
+            reg._fd = None
+            reg._close(e)
+
+    def __remove(self, reg, status=None):
+        if reg._fd is None:
+            return # not registered (anymore)
+        try:
+            self.__selector.unregister(reg._fd)
+        except (KeyError, ValueError):
+            pass
+        reg._fd = None
+        try:
+            reg.source.cancel()
+        except Exception as e:
+            _LOGGER.error(f"***failed to cancel {reg.source}: {e}")
+            if status is None:
+                status = e
+        finally:
+            reg._close(status)
+
+    def __process_commands(self):
+        self.__waker.clear()
+        while True:
+            with self.__lock:
+                if not self.__commands:
+                    return
+                func, args = self.__commands.popleft()
+            try:
+                func(*args)
+            except Exception as e: # keep the reactor running for the other sources
+                _LOGGER.error(f"***reactor command {func.__name__} failed: {e}")
+
+    def __run(self):
+        while True:
+            woken = False
+            for key, _ in self.__selector.select():
+                reg = key.data
+                if reg is None:
+                    woken = True
+                    continue
+                try:
+                    events = reg.source.read_available()
+                    if events:
+                        reg._post_events(events)
+                except Exception as e: # only stops the offending source
+                    _log_read_error(reg.source, e)
+                    self.__remove(reg, e)
+            if woken == True:
+                self.__process_commands()
+
+_shared      = None
+_shared_lock = _threading.Lock()
+
+def shared():
+    """returns the Reactor instance shared within the process."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Reactor()
+        return _shared
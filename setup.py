@@ -10,10 +10,12 @@ setuptools.setup(
     author_email='keisuke.sehara@gmail.com',
     license='MIT',
     install_requires=[],
+    python_requires='>=3.9',
     classifiers=[
         'Development Status :: 3 - Alpha',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: Free Threading :: 2 - Beta',
         ],
     packages=['eventcalls',],
     entry_points={
@@ -0,0 +1,209 @@
+import os
+import time
+import socket
+import threading
+import unittest
+
+import eventcalls
+from eventcalls.io import DatagramIO
+
+TIMEOUT = 5.0
+
+def wait_until(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def _port_of(source):
+    return source._DatagramIO__endpoint.getsockname()[1]
+
+class Recorder(eventcalls.EventHandler):
+    def __init__(self, fail_on=None, gate=None):
+        self.events  = []
+        self.status  = []
+        self.fail_on = fail_on
+        self.gate    = gate
+
+    def handle(self, evt):
+        if self.gate is not None:
+            self.gate.wait(TIMEOUT)
+        data, addr = evt
+        self.events.append(bytes(data))
+        if data == self.fail_on:
+            raise RuntimeError("handler failure")
+
+    def done(self, evt=None):
+        self.status.append(evt)
+
+class RoutineTestBase:
+    """test cases shared among the dispatch modes.
+    subclasses set `options` to the keyword arguments for Routine."""
+    options = {}
+
+    def setUp(self):
+        self.source = DatagramIO.bind(0)
+        self.port   = _port_of(self.source)
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sender.close()
+
+    def send(self, *payloads):
+        for payload in payloads:
+            self.sender.sendto(payload, ('localhost', self.port))
+
+    def test_receives_in_order(self):
+        handler = Recorder()
+        routine = eventcalls.Routine(self.source, handler, **self.options)
+        payloads = [b'%d' % i for i in range(20)]
+        self.send(*payloads)
+        self.assertTrue(wait_until(lambda: len(handler.events) == len(payloads)))
+        routine.stop()
+        self.assertEqual(handler.events, payloads)
+        self.assertEqual(handler.status, [None])
+        self.assertFalse(routine.is_running())
+
+    def test_endpoint_with_timeout(self):
+        # sockets with a timeout ignore MSG_DONTWAIT: draining must not block on them
+        endpoint = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        endpoint.settimeout(1.0)
+        endpoint.bind(('localhost', 0))
+        self.port = endpoint.getsockname()[1]
+        handler  = Recorder()
+        payloads = [b'%d' % i for i in range(5)]
+        self.send(*payloads) # queued up before the first read
+        routine  = eventcalls.Routine(DatagramIO(endpoint), handler, **self.options)
+        self.assertTrue(wait_until(lambda: len(handler.events) == len(payloads)))
+        time.sleep(0.2)
+        routine.stop()
+        self.assertEqual(handler.events, payloads)
+        self.assertEqual(handler.status, [None])
+
+    def test_stop_twice(self):
+        handler = Recorder()
+        routine = eventcalls.Routine(self.source, handler, **self.options)
+        routine.stop()
+        # the second stop must not write into a file that reuses a freed descriptor
+        rfd, wfd = os.pipe()
+        try:
+            os.set_blocking(rfd, False)
+            routine.stop()
+            with self.assertRaises(BlockingIOError):
+                os.read(rfd, 64)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+        self.assertEqual(handler.status, [None])
+
+    def test_handler_failure(self):
+        handler = Recorder(fail_on=b'boom')
+        routine = eventcalls.Routine(self.source, handler, **self.options)
+        self.send(b'a', b'boom')
+        self.assertTrue(wait_until(lambda: len(handler.status) == 1))
+        routine.stop()
+        self.assertEqual(handler.events, [b'a', b'boom'])
+        self.assertIsInstance(handler.status[0], RuntimeError)
+
+class ThreadRoutineTest(RoutineTestBase, unittest.TestCase):
+    options = {}
+
+    def test_handler_failure(self):
+        # in the thread mode, the exception propagates out of the reading thread
+        # after the handler is done
+        raised = []
+        hook, threading.excepthook = threading.excepthook, lambda args: raised.append(args.exc_value)
+        try:
+            handler = Recorder(fail_on=b'boom')
+            routine = eventcalls.Routine(self.source, handler)
+            self.send(b'a', b'boom', b'b')
+            self.assertTrue(wait_until(lambda: len(raised) == 1))
+            routine.stop()
+        finally:
+            threading.excepthook = hook
+        self.assertEqual(handler.events, [b'a', b'boom'])
+        self.assertEqual(handler.status, [None])
+        self.assertIsInstance(raised[0], RuntimeError)
+        self.assertFalse(routine.is_running())
+
+class QueueRoutineTest(RoutineTestBase, unittest.TestCase):
+    options = dict(queue_size=8)
+
+    def test_drop_oldest(self):
+        gate    = threading.Event()
+        handler = Recorder(gate=gate)
+        routine = eventcalls.Routine(self.source, handler, queue_size=2, drop_oldest=True)
+        payloads = [b'%d' % i for i in range(10)]
+        self.send(*payloads)
+        # the first event blocks the consumer, so that the rest overflow the queue
+        self.assertTrue(wait_until(lambda: routine.dropped_count > 0))
+        gate.set()
+        self.assertTrue(wait_until(lambda: len(handler.events) + routine.dropped_count == len(payloads)))
+        routine.stop()
+        self.assertEqual(handler.events[-1], payloads[-1])
+
+    def test_transient_events_refused(self):
+        with self.assertRaises(ValueError):
+            eventcalls.Routine(DatagramIO.bind(0, copy=False), Recorder(), queue_size=8)
+
+    def test_no_workers_refused(self):
+        with self.assertRaises(ValueError):
+            eventcalls.Routine(self.source, Recorder(), queue_size=8, workers=0)
+
+class ReactorRoutineTest(RoutineTestBase, unittest.TestCase):
+    options = dict(reactor=True)
+
+    def test_transient_events_refused(self):
+        with self.assertRaises(ValueError):
+            eventcalls.Routine(DatagramIO.bind(0, copy=False), Recorder(), reactor=True)
+
+    def test_failing_source(self):
+        class Failing(DatagramIO):
+            __slots__ = ()
+            def read_available(self):
+                raise ValueError("source failure")
+
+        failing = Failing.bind(0)
+        failing_handler = Recorder()
+        failing_routine = eventcalls.Routine(failing, failing_handler, reactor=True)
+        handler = Recorder()
+        routine = eventcalls.Routine(self.source, handler, reactor=True)
+
+        self.sender.sendto(b'x', ('localhost', _port_of(failing)))
+        self.assertTrue(wait_until(lambda: len(failing_handler.status) == 1))
+        self.assertIsInstance(failing_handler.status[0], ValueError)
+
+        # the other source on the same reactor keeps running
+        self.send(b'y')
+        self.assertTrue(wait_until(lambda: handler.events == [b'y']))
+        failing_routine.stop()
+        routine.stop()
+        self.assertEqual(handler.status, [None])
+
+    def test_initialization_failure(self):
+        class Failing(Recorder):
+            def initialized(self, evt=None):
+                raise RuntimeError("initialization failure")
+
+        handler = Failing()
+        routine = eventcalls.Routine(self.source, handler, reactor=True)
+        self.assertTrue(wait_until(lambda: len(handler.status) == 1))
+        self.assertIsInstance(handler.status[0], RuntimeError)
+        self.send(b'a')
+        routine.stop() # must not hang
+        self.assertFalse(routine.is_running())
+        self.assertEqual(handler.events, [])
+
+        # the reactor keeps on serving the other sources
+        other   = DatagramIO.bind(0)
+        handler = Recorder()
+        routine = eventcalls.Routine(other, handler, reactor=True)
+        self.sender.sendto(b'b', ('localhost', _port_of(other)))
+        self.assertTrue(wait_until(lambda: handler.events == [b'b']))
+        routine.stop()
+        self.assertEqual(handler.status, [None])
+
+if __name__ == '__main__':
+    unittest.main()
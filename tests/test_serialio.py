@@ -0,0 +1,68 @@
+import unittest
+
+from eventcalls.io import SerialIO
+
+class StubPort:
+    """a serial port that returns the given chunks in turn.
+    an empty chunk stands for a read timeout."""
+    name = 'stub'
+
+    def __init__(self, *chunks):
+        self.chunks  = list(chunks)
+        self.written = []
+        self.closed  = False
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        if not self.chunks:
+            return b''
+        chunk = self.chunks.pop(0)
+        if len(chunk) > size:
+            self.chunks.insert(0, chunk[size:])
+        return chunk[:size]
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+class SerialIOTest(unittest.TestCase):
+    def test_line_splitting(self):
+        port = StubPort(b'ab', b'', b'c\nde', b'f\n\ng', b'', b'h\n')
+        io   = SerialIO(port)
+        self.assertEqual([io.read_single() for _ in range(4)],
+                         [b'abc\n', b'def\n', b'\n', b'gh\n'])
+
+    def test_bytes(self):
+        port = StubPort(b'', b'ab', b'', b'c')
+        io   = SerialIO(port, line_oriented=False)
+        self.assertEqual([io.read_single() for _ in range(3)], [b'a', b'b', b'c'])
+
+    def test_cancel_on_timeout(self):
+        port = StubPort(b'ab')
+        io   = SerialIO(port)
+        io._canceled = True # as set by cancel(), without closing the port
+        self.assertIs(io.read_single(), SerialIO.CANCELED)
+        self.assertTrue(port.closed)
+
+    def test_iteration_ends_on_cancel(self):
+        port = StubPort(b'a\n', b'')
+        io   = SerialIO(port)
+        events = iter(io)
+        self.assertEqual(next(events), b'a\n')
+        io.cancel()
+        self.assertEqual(list(events), [])
+
+    def test_write_terminates_lines(self):
+        port = StubPort()
+        io   = SerialIO(port)
+        io.write('a')
+        io.write(b'b\n')
+        self.assertEqual(port.written, [b'a\r\n', b'b\n'])
+
+if __name__ == '__main__':
+    unittest.main()